@@ -9,24 +9,32 @@ Copyright 2017-2018 Canonical Ltd.
 Joshua Powers <josh.powers@canonical.com>
 """
 
-from functools import lru_cache
+import re
 
 
-DISTRIBUTION_RESOURCE_TYPE_LINK = (
-    'https://api.launchpad.net/devel/#distribution'
+# Launchpad composes task titles as 'Bug #<id> in <target>: "<summary>"'
+TITLE_RE = re.compile(
+    r'Bug #(?P<number>\d+) in (?P<src>[^\s:]+)[^:]*: "(?P<short_title>.*)"$'
 )
 
-DISTRIBUTION_SOURCE_PACKAGE_RESOURCE_TYPE_LINK = (
-    'https://api.launchpad.net/devel/#distribution_source_package'
-)
 
-SOURCE_PACKAGE_RESOURCE_TYPE_LINK = (
-    'https://api.launchpad.net/devel/#source_package'
-)
+class cached_property:  # pylint: disable=invalid-name,too-few-public-methods
+    """Property computed once per instance and then stored on it.
 
-PROJECT_RESOURCE_TYPE_LINK = (
-    'https://api.launchpad.net/devel/#project'
-)
+    Like functools.cached_property, which needs Python 3.8.
+    """
+
+    def __init__(self, func):
+        """Wrap the function computing the value."""
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner=None):
+        """Compute the value and shadow this descriptor with it."""
+        if instance is None:
+            return self
+        value = instance.__dict__[self.func.__name__] = self.func(instance)
+        return value
 
 
 def truncate_string(text, length=20):
@@ -44,6 +52,8 @@ class Task:
     LONG_URL_ROOT = 'https://pad.lv/'
     SHORTLINK_ROOT = 'LP: #'
     BUG_NUMBER_LENGTH = 7
+    LONG_URL_WIDTH = BUG_NUMBER_LENGTH + len(LONG_URL_ROOT)
+    SHORTLINK_WIDTH = BUG_NUMBER_LENGTH + len(SHORTLINK_ROOT)
     AGE = None
     OLD = None
 
@@ -74,48 +84,56 @@ class Task:
         """User-facing "shortlink" that gnome-terminal will autolink."""
         return self.SHORTLINK_ROOT + self.number
 
-    @property
-    @lru_cache()
+    @cached_property
     def number(self):
         """Bug number as a string."""
         # This could be str(self.obj.bug.id) but using self.title is
         # significantly faster
-        return self.title.split(' ')[1].replace('#', '')
+        return self.title_fields['number']
 
-    @property
-    @lru_cache()
+    @cached_property
+    def bug(self):
+        """Bug of the task, shared so that it is only fetched once."""
+        return self.obj.bug
+
+    @cached_property
     def tags(self):
         """List of the Bugs tags."""
-        return self.obj.bug.tags
+        return self.bug.tags
 
-    @property
-    @lru_cache()
+    @cached_property
     def date_last_updated(self):
         """Last update as datetime returned by launchpad."""
-        return self.obj.bug.date_last_updated
+        return self.bug.date_last_updated
 
-    @property
-    @lru_cache()
+    @cached_property
     def importance(self):
         """Return importance as returned by launchpad."""
         return self.obj.importance
 
-    @property
-    @lru_cache()
+    @cached_property
     def src(self):
         """Source package."""
         # This could be self.target.name but using self.title is
         # significantly faster
-        return self.title.split(' ')[3]
+        return self.title_fields['src']
 
-    @property
-    @lru_cache()
+    @cached_property
     def title(self):
         """Title as returned by launchpadlib."""
         return self.obj.title
 
-    @property
-    @lru_cache()
+    @cached_property
+    def title_fields(self):
+        """Fields parsed from the title, shared by the derived properties."""
+        match = TITLE_RE.match(self.title)
+        if match is None:
+            raise ValueError('Cannot parse title of task %s: %s' % (
+                self.obj.self_link, self.title
+            ))
+        return match.groupdict()
+
+    @cached_property
     def assignee(self):
         """Assignee as string returned by launchpadlib."""
         # String like https://api.launchpad.net/devel/~ahasenack
@@ -125,25 +143,17 @@ class Task:
             return self.obj.assignee_link.split('~')[1]
         return False
 
-    @property
-    @lru_cache()
+    @cached_property
     def status(self):
         """Status as returned by launchpadlib."""
         return self.obj.status
 
-    @property
-    @lru_cache()
+    @cached_property
     def short_title(self):
         """Bug summary."""
         # This could be self.obj.bug.title but using self.title is
         # significantly faster
-        start_field = {
-            DISTRIBUTION_RESOURCE_TYPE_LINK: 4,
-            DISTRIBUTION_SOURCE_PACKAGE_RESOURCE_TYPE_LINK: 5,
-            SOURCE_PACKAGE_RESOURCE_TYPE_LINK: 6,
-            PROJECT_RESOURCE_TYPE_LINK: 7,
-        }[self.obj.target.resource_type_link]
-        return ' '.join(self.title.split(' ')[start_field:]).replace('"', '')
+        return self.title_fields['short_title']
 
     def get_flags(self, newbug=False):
         """Get flags representing the status of the task.
@@ -171,34 +181,24 @@ class Task:
     def compose_pretty(self, shortlinks=True, extended=False, newbug=False):
         """Compose a printable line of relevant information."""
         if shortlinks:
-            format_string = (
-                '%-' +
-                str(self.BUG_NUMBER_LENGTH + len(self.SHORTLINK_ROOT)) +
-                's'
-            )
-            bug_url = format_string % self.shortlink
+            bug_url = f'{self.shortlink:<{self.SHORTLINK_WIDTH}}'
         else:
-            format_string = (
-                '%-' +
-                str(self.BUG_NUMBER_LENGTH + len(self.LONG_URL_ROOT)) +
-                's'
-            )
-            bug_url = format_string % self.url
+            bug_url = f'{self.url:<{self.LONG_URL_WIDTH}}'
 
-        text = '%s - %s %-13s %-19s' % (
-            bug_url,
-            self.get_flags(newbug),
-            ('%s' % self.status),
-            ('[%s]' % truncate_string(self.src, 16))
+        src = f'[{truncate_string(self.src, 16)}]'
+        text = (
+            f'{bug_url} - {self.get_flags(newbug)} {self.status:<13} {src:<19}'
         )
         if extended:
-            text += ' %8s %-10s %-13s' % (
-                self.date_last_updated.strftime('%d.%m.%y'),
-                self.importance,
-                ('' if not self.assignee
-                 else '=> %s' % truncate_string(self.assignee, 9))
+            assignee = (
+                f'=> {truncate_string(self.assignee, 9)}' if self.assignee
+                else ''
+            )
+            text += (
+                f' {self.date_last_updated:%d.%m.%y} {self.importance:<10}'
+                f' {assignee:<13}'
             )
-        text += ' - %s' % truncate_string(self.short_title, 60)
+        text += f' - {truncate_string(self.short_title, 60)}'
         return text
 
     def compose_dup(self, extended=False):
@@ -0,0 +1,57 @@
+"""Test task with pytest."""
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from ustriage.task import Task
+
+
+@pytest.mark.parametrize('title,number,src,short_title', [
+    ('Bug #1 in Ubuntu: "Microsoft has a majority market share"',
+     '1', 'Ubuntu', 'Microsoft has a majority market share'),
+    ('Bug #1829201 in qemu (Ubuntu): "crash: on "info" command"',
+     '1829201', 'qemu', 'crash: on "info" command'),
+    ('Bug #1912345 in samba (Ubuntu Focal): "Fails to start"',
+     '1912345', 'samba', 'Fails to start'),
+    ('Not a task title', ValueError, None, None),
+])
+def test_title_fields(title, number, src, short_title):
+    """Test fields derived from the task title."""
+    task = Task.create_from_launchpadlib_object(SimpleNamespace(
+        title=title,
+        self_link='https://api.launchpad.net/devel/ubuntu/+bug/1',
+    ))
+    if number is ValueError:
+        with pytest.raises(ValueError, match=r'/\+bug/1'):
+            _ = task.number
+        return
+    assert task.number == number
+    assert task.src == src
+    assert task.short_title == short_title
+
+
+@pytest.mark.parametrize('shortlinks,extended,expected', [
+    (True, False, 'LP: #1829201 - *   v Triaged       [qemu]              '
+                  '- crash on info command'),
+    (False, False, 'https://pad.lv/1829201 - *   v Triaged       [qemu]'
+                   '              - crash on info command'),
+    (True, True, 'LP: #1829201 - *   v Triaged       [qemu]              '
+                 '15.04.21 High       => paelzer    - crash on info command'),
+])
+def test_compose_pretty(shortlinks, extended, expected):
+    """Test the layout of a printed task."""
+    obj = SimpleNamespace(
+        title='Bug #1829201 in qemu (Ubuntu): "crash on info command"',
+        status='Triaged',
+        importance='High',
+        assignee_link='https://api.launchpad.net/devel/~paelzer',
+        bug=SimpleNamespace(
+            tags=['verification-needed'],
+            date_last_updated=datetime(2021, 4, 15, tzinfo=timezone.utc),
+        ),
+    )
+    task = Task.create_from_launchpadlib_object(obj, subscribed=True)
+    assert task.compose_pretty(
+        shortlinks=shortlinks, extended=extended
+    ) == expected
@@ -10,6 +10,7 @@ Christian Ehrhardt <christian.ehrhardt@canonical.com>
 """
 import argparse
 from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 import logging
 import os
 import re
@@ -27,6 +28,12 @@ from lazr.restfulclient.errors import ClientError
 
 from .task import Task
 
+try:
+    import diskcache
+except ImportError:
+    # The activity cache is only an optimisation, run without it
+    diskcache = None
+
 PACKAGE_BLACKLIST = {
     'cloud-init',
     'curtin',
@@ -41,6 +48,13 @@ TEAMLPNAME = "ubuntu-server"
 DEFAULTTAG = "server-todo"
 FLAG_RECENT_AGE = 6
 FLAG_OLD_AGE = 90
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'ustriage'
+)
+# Cached entries are keyed on the last update of a bug and are therefore
+# never stale, the expiry only keeps the cache from growing forever
+CACHE_EXPIRE = 90 * 24 * 60 * 60
 
 # See the "Merge Board Coordination" specification for details about these tags
 PACKAGING_TASK_TAGS = [
@@ -95,6 +109,17 @@ def fast_target_name(obj):
     return obj.target_link.split('/')[-1]
 
 
+@lru_cache()
+def activity_cache():
+    """Return the persistent cache of recent bug activity.
+
+    Returns None if diskcache is not installed.
+    """
+    if diskcache is None:
+        return None
+    return diskcache.Cache(os.path.join(CACHE_DIR, 'activity'))
+
+
 def searchTasks_in_all_active_series(distro, *args, **kwargs):  # noqa: E501 pylint: disable=invalid-name
     """Unionize searchTasks() for all active series of a distribution.
 
@@ -127,6 +152,9 @@ def searchTasks_in_all_active_series(distro, *args, **kwargs):  # noqa: E501 pyl
     # want the caller to have to know which to use, but YAGNI for now.
     assert distro.resource_type_link == DISTRIBUTION_RESOURCE_TYPE_LINK
 
+    # The searches are deliberately issued one after another: all of them go
+    # through the single httplib2 connection of the launchpadlib object,
+    # which is not thread safe, so they can't be spread over a thread pool.
     result = {
         (task.bug_link, fast_target_name(task)): task
         for task in distro.searchTasks(*args, **kwargs)
@@ -223,11 +251,13 @@ def reverse_auto_date_range(start, end):
     return None
 
 
+@lru_cache()
 def connect_launchpad():
     """Use the launchpad module connect to launchpad.
 
     Will connect you to the Launchpad website the first time you run
-    this to authorize your system to connect.
+    this to authorize your system to connect. The connection is set up
+    once and shared by all callers.
     """
     cred_location = os.path.expanduser('~/.lp_creds')
     credential_store = UnencryptedFileCredentialStore(cred_location)
@@ -235,31 +265,51 @@ def connect_launchpad():
                                 credential_store=credential_store)
 
 
+@lru_cache()
+def lp_ubuntu():
+    """Return the Ubuntu distribution, looked up once per run."""
+    # Distribution List: https://launchpad.net/distros
+    return connect_launchpad().distributions['Ubuntu']
+
+
+@lru_cache()
+def lp_person(lpname):
+    """Return the Launchpad person or team, looked up once per run."""
+    return connect_launchpad().people[lpname]
+
+
 def parse_dates(start, end=None):
-    """Validate dates are setup correctly."""
+    """Validate dates are setup correctly.
+
+    :param str start: start date as '%Y-%m-%d', day of week keyword or None
+    :param str end: inclusive end date as '%Y-%m-%d' or None
+    :returns: start (inclusive) and end (exclusive) of the range
+    :rtype: tuple(datetime.date, datetime.date)
+    """
     # if start date is not set we search all bugs of a LP user/team
     if not start:
         logging.info('No date set, auto-search yesterday/weekend for the '
                      'most common triage.')
         yesterday = datetime.now().date() - timedelta(days=1)
         if yesterday.weekday() != 6:
-            start = yesterday.strftime('%Y-%m-%d')
+            start_date = yesterday
         else:
             # include weekend if yesterday was a sunday
-            start = (yesterday - timedelta(days=2)).strftime('%Y-%m-%d')
-            end = yesterday.strftime('%Y-%m-%d')
+            start_date = yesterday - timedelta(days=2)
+        end_date = yesterday
 
-    if re.fullmatch(r'\d{4}-\d{2}-\d{2}', start):
+    elif re.fullmatch(r'\d{4}-\d{2}-\d{2}', start):
+        start_date = datetime.strptime(start, '%Y-%m-%d').date()
         # If end date is not set set it to start so we can
         # properly show the inclusive list of dates.
-        if not end:
-            end = start
+        if end:
+            end_date = datetime.strptime(end, '%Y-%m-%d').date()
+        else:
+            end_date = start_date
 
-    elif start and not end:
+    elif not end:
         try:
             start_date, end_date = auto_date_range(start)
-            start = start_date.strftime('%Y-%m-%d')
-            end = end_date.strftime('%Y-%m-%d')
         except ValueError as error:
             raise ValueError("Cannot parse date: %s" % start) from error
 
@@ -267,10 +317,16 @@ def parse_dates(start, end=None):
         raise ValueError("Cannot parse date range: %s %s" % (start, end))
 
     # Always add one to end date to make the dates inclusive
-    end = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)
-    end = end.strftime('%Y-%m-%d')
+    return start_date, end_date + timedelta(days=1)
 
-    return start, end
+
+def date_in_future(day):
+    """Return whether a date has not been reached yet in UTC.
+
+    Launchpad interprets a plain date given as modified_since as midnight
+    UTC, so nothing can have been modified since a date in the future.
+    """
+    return day > datetime.now(timezone.utc).date()
 
 
 def handle_files(filename_save, filename_compare, reportedbugs, former_bugs,
@@ -291,15 +347,18 @@ def handle_files(filename_save, filename_compare, reportedbugs, former_bugs,
                    shortlinks=shortlinks, is_sorted=True, extended=extended)
 
 
-def handle_webbrowser(open_in_browser, url):
+def handle_webbrowser(open_in_browser, urls):
     """Rate limited opening of urls in the browser."""
-    if open_in_browser > 1:
-        webbrowser.open_new_tab(url)
-        time.sleep(1.2)
-    elif open_in_browser == 1:
-        webbrowser.open(url)
-        open_in_browser += 1
-        time.sleep(5)
+    if not open_in_browser:
+        return
+    for index, url in enumerate(urls):
+        if index:
+            webbrowser.open_new_tab(url)
+            time.sleep(1.2)
+        else:
+            # Give a browser that is not running yet time to start up
+            webbrowser.open(url)
+            time.sleep(5)
 
 
 def print_bugs(tasks, open_in_browser=0, shortlinks=True, blacklist=None,
@@ -341,50 +400,43 @@ def print_bugs(tasks, open_in_browser=0, shortlinks=True, blacklist=None,
             former_bugs = yaml.safe_load(comparebugs)
 
     reportedbugs = []
-    reported_further_tasks = False
+    urls = []
+    further_tasks = []
     for task in sorted_filtered_tasks:
         if task.number in reportedbugs:
-            if reported_further_tasks:
-                print(", ", end='')
-            else:
-                print("Also: ", end='')
-            print("[%s]" % task.compose_dup(extended=extended), end='')
-            reported_further_tasks = True
+            further_tasks.append("[%s]" % task.compose_dup(extended=extended))
             continue
-        if reported_further_tasks:
-            # Add newline after additional tasks are complete
-            print()
-        reported_further_tasks = False
+        if further_tasks:
+            # Additional tasks of the former bug are complete
+            print("Also: %s" % ", ".join(further_tasks))
+            further_tasks = []
 
         newbug = filename_compare and task.number not in former_bugs
         print(task.compose_pretty(shortlinks=shortlinks, extended=extended,
                                   newbug=newbug))
 
-        handle_webbrowser(open_in_browser, task.url)
+        urls.append(task.url)
         reportedbugs.append(task.number)
 
-    if reported_further_tasks:
-        # Add newline after additional tasks are complete
-        print()
+    if further_tasks:
+        # Additional tasks of the last bug are complete
+        print("Also: %s" % ", ".join(further_tasks))
+
+    # Only open the browser once the list is complete, so that printing
+    # isn't held up by the rate limiting
+    handle_webbrowser(open_in_browser, urls)
 
     handle_files(filename_save, filename_compare, reportedbugs, former_bugs,
                  shortlinks=shortlinks, extended=extended)
 
 
-def last_activity_ours(task, activitysubscribers):
-    """Work out whether the last person to work on this bug was one of us.
+def recent_activity(bug):
+    """Return the most recent activity on a bug.
 
-    task: a Launchpad task object
-    activitysubscribers: a set of Launchpad person objects
+    bug: a Launchpad bug object
 
-    Returns a boolean
+    Returns a list of (date, person.self_link) tuples, oldest first
     """
-    # If activitysubscribers is empty, then it wasn't one of us
-    if not activitysubscribers:
-        return False
-
-    activitysubscribers_links = {p.self_link for p in activitysubscribers}
-
     # 1. activity_list shall contain a tuple of (date, person.self_link) pairs
     # 2. messages collection is ordered and the last few elements are enough
     # This avoid too many API round trips to launchpad. With 0.1-0.5 seconds
@@ -392,9 +444,9 @@ def last_activity_ours(task, activitysubscribers):
     # the former rather excessive times on bugs with many comments
     # Note: negative like [-3:] slices are not allowed here
     activity_list = []
-    last_msgs_end = len(task.bug.messages)
+    last_msgs_end = len(bug.messages)
     last_msgs_start = 0 if last_msgs_end < 3 else last_msgs_end-3
-    for msg in task.bug.messages[last_msgs_start:last_msgs_end]:
+    for msg in bug.messages[last_msgs_start:last_msgs_end]:
         try:
             activity_list.append((msg.date_created, msg.owner.self_link))
         except ClientError as exc:
@@ -402,6 +454,36 @@ def last_activity_ours(task, activitysubscribers):
                 continue
             raise
 
+    return activity_list
+
+
+def last_activity_ours(bug, activitysubscribers):
+    """Work out whether the last person to work on this bug was one of us.
+
+    bug: a Launchpad bug object
+    activitysubscribers: a set of Launchpad person objects
+
+    Returns a boolean
+    """
+    # If activitysubscribers is empty, then it wasn't one of us
+    if not activitysubscribers:
+        return False
+
+    activitysubscribers_links = {p.self_link for p in activitysubscribers}
+
+    # Any new message bumps the date the bug was last updated, so a cached
+    # activity list for the same date is still accurate and saves fetching
+    # the messages again on repeated runs
+    cache = activity_cache()
+    if cache is None:
+        activity_list = recent_activity(bug)
+    else:
+        cache_key = (bug.self_link, bug.date_last_updated.isoformat())
+        activity_list = cache.get(cache_key)
+        if activity_list is None:
+            activity_list = recent_activity(bug)
+            cache.set(cache_key, activity_list, expire=CACHE_EXPIRE)
+
     most_recent_activity = activity_list.pop()
 
     # Consider anything within an hour of the last activity or message as
@@ -426,73 +508,81 @@ def last_activity_ours(task, activitysubscribers):
 
 def create_bug_list(
         start_date, end_date, lpname, bugsubscriber, activitysubscribers,
-        tags=None, status=POSSIBLE_BUG_STATUSES
+        tags=None, status=POSSIBLE_BUG_STATUSES, blacklist=None
 ):  # pylint: disable=dangerous-default-value
-    """Return a list of bugs modified between dates."""
-    # Distribution List: https://launchpad.net/distros
+    """Yield the tasks of bugs modified between dates."""
+    blacklist = blacklist or []
     # API Doc: https://launchpad.net/+apidoc/1.0.html
-    launchpad = connect_launchpad()
-    project = launchpad.distributions['Ubuntu']
-    team = launchpad.people[lpname]
+    project = lp_ubuntu()
+    team = lp_person(lpname)
 
     if start_date is not None and end_date is not None:
+        # Nothing can have been modified since an end date that is yet to
+        # come (e.g. when triaging today), so skip those round trips
+        end_in_future = date_in_future(end_date)
         if bugsubscriber:
             # direct subscriber
             bugs_since_start = {
                 task.self_link: task for task in
                 searchTasks_in_all_active_series(
                     project,
-                    modified_since=start_date,
+                    modified_since=start_date.isoformat(),
                     bug_subscriber=team,
                     tags=tags,
                     tags_combinator='All',
                     status=status,
                 )}
-            bugs_since_end = {
-                task.self_link: task for task in
+            links_since_end = set() if end_in_future else {
+                task.self_link for task in
                 searchTasks_in_all_active_series(
                     project,
-                    modified_since=end_date,
+                    modified_since=end_date.isoformat(),
                     bug_subscriber=team,
                     tags=tags,
                     tags_combinator='All',
                     status=status,
                 )}
 
-            # N/A for direct subscribers
-            already_sub_since_start = {}
-
         else:
             # structural_subscriber sans already subscribed
             bugs_since_start = {
                 task.self_link: task for task in
                 searchTasks_in_all_active_series(
                     project,
-                    modified_since=start_date, structural_subscriber=team,
+                    modified_since=start_date.isoformat(),
+                    structural_subscriber=team,
                     status=status,
                 )}
-            bugs_since_end = {
-                task.self_link: task for task in
+            links_since_end = set() if end_in_future else {
+                task.self_link for task in
                 searchTasks_in_all_active_series(
                     project,
-                    modified_since=end_date, structural_subscriber=team,
+                    modified_since=end_date.isoformat(),
+                    structural_subscriber=team,
                     status=status,
                 )}
-            already_sub_since_start = {
-                task.self_link: task for task in
+
+        bugs_in_range = {
+            link: bugs_since_start[link]
+            for link in bugs_since_start.keys() - links_since_end
+        }
+
+        if bugsubscriber or not bugs_in_range:
+            # N/A for direct subscribers, and nothing to flag otherwise
+            already_sub_since_start = frozenset()
+        else:
+            # Only the links are needed to flag the bugs in range
+            already_sub_since_start = frozenset(
+                task.self_link for task in
                 searchTasks_in_all_active_series(
                     project,
-                    modified_since=start_date, structural_subscriber=team,
+                    modified_since=start_date.isoformat(),
+                    structural_subscriber=team,
                     bug_subscriber=team,
                     status=status,
-                )}
-
-        bugs_in_range = {
-            link: task for link, task in bugs_since_start.items()
-            if link not in bugs_since_end
-        }
+                ))
     else:
-        already_sub_since_start = {}
+        already_sub_since_start = frozenset()
         if bugsubscriber:
             # direct subscriber
             bugs_in_range = {
@@ -514,16 +604,20 @@ def create_bug_list(
                     status=status,
                 )}
 
-    bugs = {
-        Task.create_from_launchpadlib_object(
+    for link, task in bugs_in_range.items():
+        # print_bugs would drop these anyway, skip them before any further
+        # bug details are fetched from Launchpad
+        if fast_target_name(task) in blacklist:
+            continue
+        # The bug is fetched on first use, share it with the Task so that
+        # the flags don't need to fetch it again
+        bug = task.bug
+        yield Task.create_from_launchpadlib_object(
             task,
+            bug=bug,
             subscribed=(link in already_sub_since_start),
-            last_activity_ours=last_activity_ours(task, activitysubscribers),
+            last_activity_ours=last_activity_ours(bug, activitysubscribers),
         )
-        for link, task in bugs_in_range.items()
-    }
-
-    return bugs
 
 
 def bugs_to_tasks(bug_numbers):
@@ -551,9 +645,11 @@ def report_current_backlog(lpname):
 
     This value is usually needed to track how the backlog is growing/shrinking.
     """
-    launchpad = connect_launchpad()
-    project = launchpad.distributions['Ubuntu']
-    team = launchpad.people[lpname]
+    project = lp_ubuntu()
+    team = lp_person(lpname)
+    # The total_size of a searchTasks collection would avoid the pagination,
+    # but it counts tasks of a single target rather than distinct bugs, and
+    # misses bugs whose tasks are only found through the series workaround
     sub_bugs_count = len(set((
         task.bug_link for task in searchTasks_in_all_active_series(
             project,
@@ -590,12 +686,10 @@ def print_tagged_bugs(lpname, expiration, date_range, open_browser,
         logging.info('Bugs tagged "%s" and subscribed "%s" and not touched'
                      ' in %s days',
                      ' '.join(tags), lpname, expiration['expire_tagged'])
-        expire_start = (datetime.strptime(date_range['start'], '%Y-%m-%d')
+        expire_start = (date_range['start']
                         - timedelta(days=expiration['expire_tagged']))
-        expire_end = (datetime.strptime(date_range['end'], '%Y-%m-%d')
+        expire_end = (date_range['end']
                       - timedelta(days=expiration['expire_tagged']))
-        expire_start = expire_start.strftime('%Y-%m-%d')
-        expire_end = expire_end.strftime('%Y-%m-%d')
         wanted_statuses = OPEN_BUG_STATUSES
 
     bugs = create_bug_list(
@@ -603,7 +697,8 @@ def print_tagged_bugs(lpname, expiration, date_range, open_browser,
         expire_end,
         lpname, TEAMLPNAME, activitysubscribers,
         tags=tags + ["-bot-stop-nagging"],
-        status=wanted_statuses
+        status=wanted_statuses,
+        blacklist=blacklist,
     )
     print_bugs(bugs, open_browser, shortlinks,
                blacklist=blacklist, extended=extended,
@@ -623,12 +718,10 @@ def print_subscribed_bugs(lpname, expiration, date_range, open_browser,
     else:
         logging.info('Bugs subscribed to %s and not touched in %s days',
                      lpname, expiration['expire'])
-        expire_start = (datetime.strptime(date_range['start'], '%Y-%m-%d')
+        expire_start = (date_range['start']
                         - timedelta(days=expiration['expire']))
-        expire_end = (datetime.strptime(date_range['end'], '%Y-%m-%d')
+        expire_end = (date_range['end']
                       - timedelta(days=expiration['expire']))
-        expire_start = expire_start.strftime('%Y-%m-%d')
-        expire_end = expire_end.strftime('%Y-%m-%d')
         tags = ["-bot-stop-nagging"]
 
     bugs = create_bug_list(
@@ -637,6 +730,7 @@ def print_subscribed_bugs(lpname, expiration, date_range, open_browser,
         lpname, TEAMLPNAME, None,
         tags=tags,
         status=OPEN_BUG_STATUSES,
+        blacklist=blacklist,
     )
     print_bugs(bugs, open_browser, shortlinks,
                blacklist=blacklist, limit_subscribed=limit_subscribed,
@@ -669,12 +763,14 @@ def main(date_range=None, debug=False, open_browser=None,
     """Connect to Launchpad, get range of bugs, print 'em."""
     if tags is None:
         tags = ["server-todo"]
-    launchpad = connect_launchpad()
+    connect_launchpad()
     logging.basicConfig(stream=sys.stdout, format='%(message)s',
                         level=logging.DEBUG if debug else logging.INFO)
     if activitysubscribernames:
-        activitysubscribers = (
-            launchpad.people[activitysubscribernames].members
+        # Fetch the members once, iterating the collection again for every
+        # bug would page through it from Launchpad each time
+        activitysubscribers = list(
+            lp_person(activitysubscribernames).members
         )
     else:
         activitysubscribers = []
@@ -700,11 +796,8 @@ def main(date_range=None, debug=False, open_browser=None,
 
     logging.info('---')
     # Need to display date range as inclusive
-    inclusive_start = datetime.strptime(date_range['start'], '%Y-%m-%d')
-    inclusive_end = (
-        datetime.strptime(date_range['end'], '%Y-%m-%d') -
-        timedelta(days=1)
-    )
+    inclusive_start = date_range['start']
+    inclusive_end = date_range['end'] - timedelta(days=1)
     pretty_start = inclusive_start.strftime('%Y-%m-%d (%A)')
     pretty_end = inclusive_end.strftime('%Y-%m-%d (%A)')
     if inclusive_start == inclusive_end:
@@ -730,7 +823,8 @@ def main(date_range=None, debug=False, open_browser=None,
     bugs = create_bug_list(
         date_range['start'], date_range['end'],
         lpname, bugsubscriber, activitysubscribers,
-        tags=tags
+        tags=tags,
+        blacklist=blacklist,
     )
     print_bugs(bugs, open_browser['triage'], shortlinks, blacklist=blacklist,
                extended=extended)
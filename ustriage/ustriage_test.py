@@ -1,5 +1,6 @@
 """Test ustriage with pytest."""
 import datetime
+from types import SimpleNamespace
 
 import pytest
 
@@ -54,3 +55,127 @@ def test_reverse_auto_date_range(start, end, expected):
     assert target.reverse_auto_date_range(
         parse_test_date(start), parse_test_date(end)
     ) == expected
+
+
+@pytest.mark.parametrize('start,end,expected_start,expected_end', [
+    ('2019-05-14', None, '2019-05-14', '2019-05-15'),
+    ('2019-05-10', '2019-05-12', '2019-05-10', '2019-05-13'),
+    ('2019-05-31', None, '2019-05-31', '2019-06-01'),
+])
+def test_parse_dates(start, end, expected_start, expected_end):
+    """Test parsing of the requested date range."""
+    assert target.parse_dates(start, end) == (
+        parse_test_date(expected_start), parse_test_date(expected_end)
+    )
+
+
+@pytest.mark.parametrize('start,end', [
+    ('sun', None),
+    ('2019-05-14', 'tomorrow'),
+])
+def test_parse_dates_invalid(start, end):
+    """Test rejection of unparseable date ranges."""
+    with pytest.raises(ValueError):
+        target.parse_dates(start, end)
+
+
+@pytest.mark.parametrize('day,expected', [
+    ('2019-05-14', False),
+    ('9999-12-31', True),
+])
+def test_date_in_future(day, expected):
+    """Test detection of dates yet to come."""
+    assert target.date_in_future(parse_test_date(day)) == expected
+
+
+def test_last_activity_ours_cached(tmp_path, monkeypatch):
+    """Test recent activity is cached until the bug is updated again."""
+    monkeypatch.setattr(target, 'CACHE_DIR', str(tmp_path))
+    target.activity_cache.cache_clear()
+    us = SimpleNamespace(self_link='https://api.launchpad.net/devel/~us')
+    them = SimpleNamespace(self_link='https://api.launchpad.net/devel/~them')
+    updated = datetime.datetime(2021, 4, 15, tzinfo=datetime.timezone.utc)
+    link = 'https://api.launchpad.net/devel/bugs/1'
+
+    bug = SimpleNamespace(self_link=link, date_last_updated=updated,
+                          messages=[SimpleNamespace(date_created=updated,
+                                                    owner=us)])
+    assert target.last_activity_ours(bug, [us])
+
+    # Same update date: served from the cache, messages are not read
+    bug = SimpleNamespace(self_link=link, date_last_updated=updated)
+    assert target.last_activity_ours(bug, [us])
+
+    # A newer update date: messages are read again
+    updated += datetime.timedelta(days=1)
+    bug = SimpleNamespace(self_link=link, date_last_updated=updated,
+                          messages=[SimpleNamespace(date_created=updated,
+                                                    owner=them)])
+    assert not target.last_activity_ours(bug, [us])
+    target.activity_cache.cache_clear()
+
+
+def test_last_activity_ours_without_diskcache(monkeypatch):
+    """Test recent activity is always fetched without diskcache."""
+    monkeypatch.setattr(target, 'diskcache', None)
+    target.activity_cache.cache_clear()
+    us = SimpleNamespace(self_link='https://api.launchpad.net/devel/~us')
+    updated = datetime.datetime(2021, 4, 15, tzinfo=datetime.timezone.utc)
+    bug = SimpleNamespace(self_link='https://api.launchpad.net/devel/bugs/1',
+                          date_last_updated=updated,
+                          messages=[SimpleNamespace(date_created=updated,
+                                                    owner=us)])
+    assert target.last_activity_ours(bug, [us])
+    target.activity_cache.cache_clear()
+
+
+@pytest.mark.parametrize('open_in_browser,expected', [
+    (0, []),
+    (1, [('open', 'https://pad.lv/1'), ('sleep', 5),
+         ('open_new_tab', 'https://pad.lv/2'), ('sleep', 1.2),
+         ('open_new_tab', 'https://pad.lv/3'), ('sleep', 1.2)]),
+])
+def test_handle_webbrowser(open_in_browser, expected, monkeypatch):
+    """Test rate limited opening of urls in the browser."""
+    calls = []
+    monkeypatch.setattr(target.webbrowser, 'open',
+                        lambda url: calls.append(('open', url)))
+    monkeypatch.setattr(target.webbrowser, 'open_new_tab',
+                        lambda url: calls.append(('open_new_tab', url)))
+    monkeypatch.setattr(target.time, 'sleep',
+                        lambda secs: calls.append(('sleep', secs)))
+    target.handle_webbrowser(
+        open_in_browser,
+        ['https://pad.lv/1', 'https://pad.lv/2', 'https://pad.lv/3'],
+    )
+    assert calls == expected
+
+
+def make_task(number, src, status):
+    """Make a Task backed by a fake launchpadlib object."""
+    obj = SimpleNamespace(
+        title='Bug #%s in %s (Ubuntu): "Fails to start"' % (number, src),
+        status=status,
+        bug=SimpleNamespace(tags=[]),
+    )
+    return target.Task.create_from_launchpadlib_object(obj)
+
+
+def test_print_bugs_further_tasks(capsys):
+    """Test further tasks of a bug are listed on one line."""
+    tasks = [
+        make_task(1, 'qemu', 'New'),
+        make_task(1, 'libvirt', 'Triaged'),
+        make_task(2, 'samba', 'Confirmed'),
+        make_task(2, 'sssd', 'New'),
+        make_task(2, 'krb5', 'Incomplete'),
+    ]
+    target.print_bugs(tasks, is_sorted=True)
+    assert capsys.readouterr().out == (
+        'LP: #1       -       New           [qemu]'
+        '              - Fails to start\n'
+        'Also: [Triaged,libvirt]\n'
+        'LP: #2       -       Confirmed     [samba]'
+        '             - Fails to start\n'
+        'Also: [New,sssd], [Incomplete,krb5]\n'
+    )